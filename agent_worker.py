@@ -1,12 +1,41 @@
+import io
 import time
+import base64
+import hashlib
 import logging
 import os
-from datetime import datetime, timezone
+import re
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from PIL import Image, ImageEnhance
-from database import get_db
+from urllib.parse import urlparse
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from database import get_db, ensure_indexes, MAX_TASK_ATTEMPTS
+from image_ops import SMOOTH_KERNEL, brightness_levels, contrast_pivot, histogram_pivot, tone_lut, blend_tones, sharpen
 from openai import OpenAI
-from wordpress_agent import publish_to_wordpress
+from wordpress_agent import publish_to_wordpress, warm_wordpress_pool
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420, TJCS_CMYK, TJCS_YCCK
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    # PyTurboJPEG or libturbojpeg isn't installed - fall back to Pillow
+    turbo_jpeg = None
+
+try:
+    import pyvips
+    # libvips 8.15 replaced the "strip" save option with "keep"
+    VIPS_STRIP_METADATA = {"keep": "none"} if pyvips.at_least_libvips(8, 15) else {"strip": True}
+except (ImportError, OSError):
+    # pyvips or libvips isn't installed - large photos are decoded in full
+    pyvips = None
 
 # Setup logging
 logging.basicConfig(
@@ -14,21 +43,144 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger("agent_worker")
+# libvips reports every finished threadpool at INFO
+logging.getLogger("pyvips").setLevel(logging.WARNING)
 
 db = get_db()
+ensure_indexes(db)
 client = OpenAI()
 
+JPEG_MAGIC = b"\xff\xd8"
+VISION_MODEL = "gpt-4o"
+# Photos sent to GPT-4o Vision are capped to this size and sent with detail "low"
+VISION_MAX_EDGE = 1024
+VISION_JPEG_QUALITY = 85
+# Path segments that look like a hex digest mark a content-addressed URL
+CONTENT_HASH_PATTERN = re.compile(r"[0-9a-fA-F]{32,}")
+# Identifies this process when it claims a task, so several workers can share the stream
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# A claim older than this is treated as abandoned (its worker crashed) and handed back
+CLAIM_LEASE = timedelta(minutes=15)
+# Each claimed status and the status its task returns to when the claim is released
+CLAIMED_STATUSES = {"COLOR_CORRECTING": "PHOTOS_UPLOADED", "PUBLISHING": "COLOR_CORRECTED"}
+# ...and the status it is parked in instead once MAX_TASK_ATTEMPTS runs have failed
+FAILED_STATUSES = {"COLOR_CORRECTING": "COLOR_CORRECTION_FAILED", "PUBLISHING": "PUBLISH_FAILED"}
+# Photos at least this large are streamed through libvips instead of decoded in full
+VIPS_MIN_PIXELS = 24_000_000
+# Photos of one task processed concurrently (bounded by OpenAI rate limits)
+MAX_PHOTO_WORKERS = 8
+
+# Photo downloads share one pooled session sized to the thread pool, so
+# concurrent photos from the same host reuse warm TLS connections
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_maxsize=MAX_PHOTO_WORKERS))
+http_session.mount("http://", HTTPAdapter(pool_maxsize=MAX_PHOTO_WORKERS))
+
+def read_image_bytes(source):
+    """Fetch the raw bytes of an image from a local path, file://, data: or http(s) URL"""
+    if source.startswith('data:'):
+        return base64.b64decode(source.partition(',')[2])
+    
+    if source.startswith(('http://', 'https://')):
+        response = http_session.get(source, timeout=30)
+        response.raise_for_status()
+        return response.content
+    
+    if source.startswith('file://'):
+        source = source[len('file://'):]
+    with open(source, 'rb') as f:
+        return f.read()
+
+def load_image(source, max_edge=None):
+    """Decode an image into a contiguous RGB uint8 array, optionally capped to max_edge on either side"""
+    data = read_image_bytes(source)
+    
+    if max_edge is None and turbo_jpeg is not None and data[:2] == JPEG_MAGIC:
+        # libjpeg-turbo won't convert CMYK/YCCK JPEGs (common from print
+        # workflows) to RGB, so those go through Pillow below
+        if turbo_jpeg.decode_header(data)[3] not in (TJCS_CMYK, TJCS_YCCK):
+            return turbo_jpeg.decode(data, pixel_format=TJPF_RGB)
+    
+    with Image.open(io.BytesIO(data)) as img:
+        if max_edge is not None:
+            # For JPEGs this lets the decoder scale down in the DCT domain
+            img.draft("RGB", (max_edge, max_edge))
+        img = img.convert("RGB")
+        if max_edge is not None:
+            img.thumbnail((max_edge, max_edge))
+        return np.asarray(img)
+
+def encode_jpeg(pixels, quality=95):
+    """Encode an RGB uint8 array as JPEG bytes"""
+    if turbo_jpeg is not None:
+        return turbo_jpeg.encode(pixels, quality=quality, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+    
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+def save_jpeg(pixels, path, quality=95):
+    """Encode an RGB uint8 array as JPEG and write it to path"""
+    data = encode_jpeg(pixels, quality=quality)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def is_large_image(image_path):
+    """Whether a photo is big enough to stream through libvips (reads only the header)"""
+    try:
+        header = pyvips.Image.new_from_file(image_path)
+    except pyvips.Error as e:
+        # A format libvips can't load (e.g. BMP, TGA) - leave it to Pillow
+        logger.debug("libvips can't read %s, decoding with Pillow: %s", image_path, e)
+        return False
+    return header.width * header.height >= VIPS_MIN_PIXELS
+
+def stream_color_corrections(image_path, corrected_path, brightness, contrast, saturation, sharpness):
+    """
+    Apply the same corrections as apply_color_corrections with libvips, which
+    decodes and processes the photo in strips, so memory stays flat however large it is.
+    """
+    def open_rgb():
+        image = pyvips.Image.new_from_file(image_path, access="sequential").colourspace("srgb")
+        return image.extract_band(0, n=3) if image.bands > 3 else image
+    
+    image = open_rgb()
+    
+    def luma(rgb):
+        # PIL's fixed-point "L" conversion; every intermediate is exact in float32
+        return ((rgb.recomb([[19595, 38470, 7471]]) + 0x8000) / 65536).floor()
+    
+    def uchar_lut(levels):
+        return pyvips.Image.new_from_memory(levels.tobytes(), 256, 1, 1, "uchar")
+    
+    if brightness != 1.0 or contrast != 1.0 or saturation != 1.0:
+        # The contrast pivot needs the brightened luma histogram up front, which costs a pass of its own
+        brightened = open_rgb().maplut(uchar_lut(brightness_levels(brightness)))
+        counts = luma(brightened).cast("uchar").hist_find().write_to_memory()
+        pivot = histogram_pivot(np.frombuffer(counts, dtype=np.uint32))
+        image = image.maplut(uchar_lut(tone_lut(brightness, contrast, pivot)))
+        
+        if saturation != 1.0:
+            gray = luma(image)
+            image = (gray + (image - gray) * saturation).cast("uchar")
+    
+    if sharpness != 1.0:
+        mask = pyvips.Image.new_from_array([list(SMOOTH_KERNEL[row:row + 3]) for row in (0, 3, 6)], scale=13)
+        smooth = (image.conv(mask, precision="float") + 0.5).floor()
+        sharpened = (smooth + (image - smooth) * sharpness).cast("uchar")
+        # PIL leaves the one-pixel border unsharpened
+        image = image.insert(sharpened.crop(1, 1, image.width - 2, image.height - 2), 1, 1)
+    
+    # Same 4:2:0 chroma subsampling as the Pillow encoder (libvips turns it off at Q >= 90)
+    image.write_to_file(corrected_path, Q=95, subsample_mode="on", **VIPS_STRIP_METADATA)
+
 def apply_color_corrections(image_path, adjustments=None):
     """Apply color corrections to an image and save it"""
     try:
         if not os.path.exists(image_path):
-            logger.error(f"Image file not found: {image_path}")
+            logger.error("Image file not found: %s", image_path)
             return None
         
-        # Open the image
-        img = Image.open(image_path)
-        logger.info(f"      🖼️  Opened image: {image_path}")
-        
         # Default adjustments
         if not adjustments:
             adjustments = {
@@ -38,174 +190,334 @@ def apply_color_corrections(image_path, adjustments=None):
                 "sharpness": 1.2
             }
         
-        # Apply brightness adjustment
-        if "brightness" in adjustments and adjustments["brightness"] != 1.0:
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(adjustments["brightness"])
-            logger.info(f"      ✓ Applied brightness: {adjustments['brightness']}")
+        brightness = adjustments.get("brightness", 1.0)
+        contrast = adjustments.get("contrast", 1.0)
+        saturation = adjustments.get("saturation", 1.0)
+        sharpness = adjustments.get("sharpness", 1.0)
+        
+        base_path = os.path.splitext(image_path)[0]
+        corrected_path = f"{base_path}_color_corrected.jpg"
+        
+        if pyvips is not None and is_large_image(image_path):
+            stream_color_corrections(image_path, corrected_path, brightness, contrast, saturation, sharpness)
+            logger.info("      💾 Streamed corrections through libvips: %s", corrected_path)
+            return corrected_path
         
-        # Apply contrast adjustment
-        if "contrast" in adjustments and adjustments["contrast"] != 1.0:
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(adjustments["contrast"])
-            logger.info(f"      ✓ Applied contrast: {adjustments['contrast']}")
+        # Decode once; every adjustment below works on this buffer
+        pixels = load_image(image_path)
+        logger.info("      🖼️  Opened image: %s", image_path)
         
-        # Apply saturation adjustment
-        if "saturation" in adjustments and adjustments["saturation"] != 1.0:
-            enhancer = ImageEnhance.Color(img)
-            img = enhancer.enhance(adjustments["saturation"])
-            logger.info(f"      ✓ Applied saturation: {adjustments['saturation']}")
+        if saturation != 1.0:
+            pixels = blend_tones(pixels, brightness, contrast, saturation)
+            logger.info("      ✓ Applied brightness: %s, contrast: %s, saturation: %s", brightness, contrast, saturation)
+        elif brightness != 1.0 or contrast != 1.0:
+            # Without saturation every 8-bit level maps independently, so
+            # brightness and contrast become one table lookup with no float buffer
+            pixels = tone_lut(brightness, contrast, contrast_pivot(pixels, brightness))[pixels]
+            logger.info("      ✓ Applied brightness: %s, contrast: %s", brightness, contrast)
         
-        # Apply sharpness adjustment
-        if "sharpness" in adjustments and adjustments["sharpness"] != 1.0:
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(adjustments["sharpness"])
-            logger.info(f"      ✓ Applied sharpness: {adjustments['sharpness']}")
+        if sharpness != 1.0:
+            pixels = sharpen(pixels, sharpness)
+            logger.info("      ✓ Applied sharpness: %s", sharpness)
         
         # Save corrected image
-        base_path = os.path.splitext(image_path)[0]
-        corrected_path = f"{base_path}_color_corrected.jpg"
-        img.save(corrected_path, "JPEG", quality=95)
-        logger.info(f"      💾 Saved corrected image: {corrected_path}")
+        save_jpeg(pixels, corrected_path, quality=95)
+        logger.info("      💾 Saved corrected image: %s", corrected_path)
         
         return corrected_path
         
     except Exception as e:
-        logger.error(f"      ❌ Error processing image: {e}")
+        logger.error("      ❌ Error processing image: %s", e)
         return None
 
+def vision_cache_key(photo_url):
+    """Cache key that can be derived without decoding the photo, or None if there isn't one"""
+    # A content-addressed URL (e.g. an S3 key that is a digest) always serves the same bytes
+    if photo_url.startswith('https://') and CONTENT_HASH_PATTERN.search(urlparse(photo_url).path):
+        return f"url:{photo_url}"
+    # Inline payloads are hashed as-is; SHA-1 is plenty for a local cache
+    if photo_url.startswith('data:'):
+        return f"b64:{hashlib.sha1(photo_url.partition(',')[2].encode()).hexdigest()}"
+    return None
+
+def cached_vision_analysis(cache_key):
+    """Return the cached Vision response for cache_key, if any"""
+    cached = db.vision_cache.find_one({"_id": cache_key, "model": VISION_MODEL})
+    if cached:
+        logger.info("      ♻️  Vision cache hit: %.40s", cache_key)
+        return cached["response_text"]
+    return None
+
+def analyze_with_vision(photo_url):
+    """Get a GPT-4o Vision color assessment for a photo URL, reusing cached results"""
+    cache_key = vision_cache_key(photo_url)
+    if cache_key:
+        cached = cached_vision_analysis(cache_key)
+        if cached is not None:
+            return cached
+    
+    logger.info("      ⬇️  Downloading photo...")
+    pixels = load_image(photo_url, max_edge=VISION_MAX_EDGE)
+    
+    if cache_key is None:
+        # Fall back to the decoded pixels, so the same photo hits regardless of URL or format
+        cache_key = hashlib.sha256(pixels.tobytes()).hexdigest()
+        cached = cached_vision_analysis(cache_key)
+        if cached is not None:
+            return cached
+    
+    encoded = base64.b64encode(encode_jpeg(pixels, quality=VISION_JPEG_QUALITY)).decode()
+    logger.info("      🤖 Calling OpenAI Vision API...")
+    
+    response = client.chat.completions.create(
+        model=VISION_MODEL,
+        max_tokens=500,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{encoded}",
+                            "detail": "low"
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": "Analyze this product photo for color correction. Provide: 1) Current color assessment, 2) Suggested color adjustments for e-commerce, 3) Overall quality rating. Be concise."
+                    }
+                ]
+            }
+        ]
+    )
+    
+    response_text = response.choices[0].message.content
+    db.vision_cache.update_one(
+        {"_id": cache_key},
+        {
+            "$set": {
+                "response_text": response_text,
+                "model": VISION_MODEL,
+                "created_at": datetime.now(timezone.utc)
+            }
+        },
+        upsert=True
+    )
+    return response_text
+
+def process_photo(idx, photo_url, total):
+    """Color-correct or analyze a single photo, returning (analysis, agent_log entry)"""
+    try:
+        logger.info("   📸 Analyzing photo %s/%s: %s", idx + 1, total, photo_url)
+        
+        # Check if it's a local file or URL
+        if photo_url.startswith('/') or photo_url.startswith('file://'):
+            # Local file - process it
+            logger.info("      🖼️  Processing local file")
+            
+            # Apply color corrections
+            adjustments = {
+                "brightness": 1.05,
+                "contrast": 1.1,
+                "saturation": 1.15,
+                "sharpness": 1.2
+            }
+            
+            corrected_path = apply_color_corrections(photo_url, adjustments)
+            
+            analysis = {
+                "photo_index": idx + 1,
+                "file_path": photo_url,
+                "corrected_path": corrected_path,
+                "color_correction_analysis": "Applied color corrections: brightness +5%, contrast +10%, saturation +15%, sharpness +20%",
+                "suggested_adjustments": adjustments,
+                "status": "completed" if corrected_path else "failed"
+            }
+        else:
+            # URL-based image - call OpenAI Vision on a downscaled copy
+            analysis_text = analyze_with_vision(photo_url)
+            
+            analysis = {
+                "photo_index": idx + 1,
+                "photo_url": photo_url,
+                "color_correction_analysis": analysis_text,
+                "model_used": "gpt-4o-vision"
+            }
+            logger.info("      ✅ Analysis complete: %.100s...", analysis_text)
+        
+        return analysis, {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "agent": "color_correct_agent_2a",
+            "action": "photo_analyzed",
+            "thought": f"Analyzed photo {idx + 1}/{total}: {photo_url}"
+        }
+        
+    except Exception as e:
+        logger.error("      ❌ Error analyzing photo %s: %s", idx + 1, e)
+        return {
+            "photo_index": idx + 1,
+            "photo_url": photo_url,
+            "error": str(e)
+        }, {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "agent": "color_correct_agent_2a",
+            "action": "photo_failed",
+            "thought": f"Failed to analyze photo {idx + 1}/{total}: {e}"
+        }
+
 def color_correct_agent(task_id, task_data):
     """Logic for Agent 2A: Process images with GPT-4o Vision"""
     try:
-        logger.info(f"🔄 Agent 2A: Starting color correction for task {task_id}...")
+        logger.info("🔄 Agent 2A: Starting color correction for task %s...", task_id)
         
         photo_urls = task_data.get("metadata", {}).get("photo_urls", [])
         sku_code = task_data.get("sku_code", "UNKNOWN")
         product_name = task_data.get("metadata", {}).get("product_name", "UNKNOWN")
         
-        logger.info(f"   SKU: {sku_code}")
-        logger.info(f"   Product: {product_name}")
-        logger.info(f"   Photo URLs: {photo_urls}")
+        logger.info("   SKU: %s", sku_code)
+        logger.info("   Product: %s", product_name)
+        logger.info("   Photo URLs: %s", photo_urls)
         
-        # Call OpenAI Vision API for each photo
-        vision_results = []
+        # Photos are I/O-bound (download, OpenAI, disk), so process them concurrently
+        total = len(photo_urls)
+        with ThreadPoolExecutor(max_workers=MAX_PHOTO_WORKERS) as executor:
+            results = list(executor.map(lambda item: process_photo(*item, total), enumerate(photo_urls)))
         
-        for idx, photo_url in enumerate(photo_urls):
-            try:
-                logger.info(f"   📸 Analyzing photo {idx + 1}/{len(photo_urls)}: {photo_url}")
-                
-                # Check if it's a local file or URL
-                if photo_url.startswith('/') or photo_url.startswith('file://'):
-                    # Local file - process it
-                    logger.info(f"      🖼️  Processing local file")
-                    
-                    # Apply color corrections
-                    adjustments = {
-                        "brightness": 1.05,
-                        "contrast": 1.1,
-                        "saturation": 1.15,
-                        "sharpness": 1.2
-                    }
-                    
-                    corrected_path = apply_color_corrections(photo_url, adjustments)
-                    
-                    analysis = {
-                        "photo_index": idx + 1,
-                        "file_path": photo_url,
-                        "corrected_path": corrected_path,
-                        "color_correction_analysis": "Applied color corrections: brightness +5%, contrast +10%, saturation +15%, sharpness +20%",
-                        "suggested_adjustments": adjustments,
-                        "status": "completed" if corrected_path else "failed"
-                    }
-                else:
-                    # URL-based image - call OpenAI Vision
-                    logger.info(f"      🤖 Calling OpenAI Vision API...")
-                    
-                    response = client.messages.create(
-                        model="gpt-4o",
-                        max_tokens=500,
-                        messages=[
-                            {
-                                "role": "user",
-                                "content": [
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": photo_url
-                                        }
-                                    },
-                                    {
-                                        "type": "text",
-                                        "text": "Analyze this product photo for color correction. Provide: 1) Current color assessment, 2) Suggested color adjustments for e-commerce, 3) Overall quality rating. Be concise."
-                                    }
-                                ]
-                            }
-                        ]
-                    )
-                    
-                    analysis = {
-                        "photo_index": idx + 1,
-                        "photo_url": photo_url,
-                        "color_correction_analysis": response.content[0].text,
-                        "model_used": "gpt-4o-vision"
-                    }
-                    logger.info(f"      ✅ Analysis complete: {response.content[0].text[:100]}...")
-                
-                vision_results.append(analysis)
-                
-            except Exception as e:
-                logger.error(f"      ❌ Error analyzing photo {idx + 1}: {e}")
-                vision_results.append({
-                    "photo_index": idx + 1,
-                    "photo_url": photo_url,
-                    "error": str(e)
-                })
+        vision_results = [analysis for analysis, _ in results]
+        agent_log_entries = [log_entry for _, log_entry in results]
         
         # Log agent action to agent_log
-        agent_log_entry = {
+        agent_log_entries.append({
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "agent": "color_correct_agent_2a",
             "action": "color_correction_completed",
             "thought": f"Processed {len(photo_urls)} photos for color correction using GPT-4o Vision"
-        }
+        })
         
-        # Update task with agent log, new status, and vision results
-        db.tasks.update_one(
-            {"_id": task_id}, 
+        # Update task with agent log, new status, and vision results - all
+        # per-photo log entries go out in this single write. Only while our
+        # claim still holds, so a re-delivered event never writes the task twice
+        result = db.tasks.update_one(
+            {"_id": task_id, "status": "COLOR_CORRECTING", "worker_id": WORKER_ID},
             {
                 "$set": {
                     "status": "COLOR_CORRECTED",
                     "workflow_step": 2,
                     "color_analysis": vision_results
                 },
-                "$push": {"agent_log": agent_log_entry}
+                "$push": {"agent_log": {"$each": agent_log_entries}},
+                "$unset": {"worker_id": "", "claimed_at": ""}
             }
         )
-        logger.info(f"✅ Agent 2A: Completed - task {task_id} status set to COLOR_CORRECTED")
-        logger.info(f"   📊 Stored {len(vision_results)} analysis results in MongoDB")
+        if result.modified_count == 0:
+            logger.warning("⚠️  Agent 2A: Task %s is no longer claimed by this worker, skipping write", task_id)
+            return
+        
+        logger.info("✅ Agent 2A: Completed - task %s status set to COLOR_CORRECTED", task_id)
+        logger.info("   📊 Stored %s analysis results in MongoDB", len(vision_results))
         
     except Exception as e:
-        logger.error(f"❌ Agent 2A Error processing task {task_id}: {e}", exc_info=True)
+        logger.error("❌ Agent 2A Error processing task %s: %s", task_id, e, exc_info=True)
         
-        # Log error to retry_metadata
+        # Log error to retry_metadata and release the claim so the task is
+        # retried, unless it has already failed MAX_TASK_ATTEMPTS times
         try:
+            attempts = (task_data.get("retry_metadata") or {}).get("count", 0) + 1
+            next_status = "PHOTOS_UPLOADED" if attempts < MAX_TASK_ATTEMPTS else "COLOR_CORRECTION_FAILED"
+            if next_status == "COLOR_CORRECTION_FAILED":
+                logger.error("❌ Agent 2A: Task %s failed %s times, giving up", task_id, attempts)
+            
             db.tasks.update_one(
-                {"_id": task_id},
+                {"_id": task_id, "status": "COLOR_CORRECTING", "worker_id": WORKER_ID},
                 {
-                    "$set": {"retry_metadata.last_error": str(e)},
-                    "$inc": {"retry_metadata.count": 1}
+                    "$set": {"status": next_status, "retry_metadata.last_error": str(e)},
+                    "$inc": {"retry_metadata.count": 1},
+                    "$unset": {"worker_id": "", "claimed_at": ""}
                 }
             )
         except Exception as e2:
-            logger.error(f"❌ Failed to log error: {e2}")
+            logger.error("❌ Failed to log error: %s", e2)
+
+def claim_task(task_id, from_status, to_status):
+    """
+    Atomically move a task from from_status to to_status for this worker.
+    Returns the claimed task, or None if another worker got there first.
+    """
+    return db.tasks.find_one_and_update(
+        {"_id": task_id, "status": from_status},
+        {"$set": {"status": to_status, "worker_id": WORKER_ID, "claimed_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def expired_claim_update(next_status):
+    """MongoDB update that drops an expired claim and counts it as a failed attempt"""
+    return {
+        "$set": {"status": next_status, "retry_metadata.last_error": "claim expired"},
+        "$inc": {"retry_metadata.count": 1},
+        "$unset": {"worker_id": "", "claimed_at": ""}
+    }
+
+def release_stale_claims():
+    """
+    Hand tasks whose claim has outlived CLAIM_LEASE back to their previous status.
+    The update shows up on the change stream, so any worker can claim them again.
+    An abandoned claim counts as a failed attempt, so a task that keeps taking
+    its worker down is parked in its failed status after MAX_TASK_ATTEMPTS
+    """
+    stale_before = datetime.now(timezone.utc) - CLAIM_LEASE
+    for claimed_status, from_status in CLAIMED_STATUSES.items():
+        stale = {
+            "status": claimed_status,
+            # Claims made before leases existed have no claimed_at
+            "$or": [{"claimed_at": {"$lt": stale_before}}, {"claimed_at": {"$exists": False}}]
+        }
+        
+        failed_status = FAILED_STATUSES[claimed_status]
+        result = db.tasks.update_many(
+            {**stale, "retry_metadata.count": {"$gte": MAX_TASK_ATTEMPTS - 1}},
+            expired_claim_update(failed_status)
+        )
+        if result.modified_count:
+            logger.error("❌ Gave up on %s stale %s claim(s), marked %s", result.modified_count, claimed_status, failed_status)
+        
+        # Whatever is still stale is under the cap
+        result = db.tasks.update_many(stale, expired_claim_update(from_status))
+        if result.modified_count:
+            logger.warning("⚠️  Released %s stale %s claim(s) back to %s", result.modified_count, claimed_status, from_status)
+
+def watch_stale_claims():
+    """Background sweep for claims left behind by crashed workers"""
+    while True:
+        try:
+            release_stale_claims()
+        except Exception as e:
+            logger.warning("⚠️  Could not release stale claims: %s", e)
+        time.sleep(CLAIM_LEASE.total_seconds() / 2)
+
+def warm_up_clients():
+    """Open the OpenAI and WordPress connection pools before the first task so they skip the TLS handshake"""
+    # MongoDB is already warm: ensure_indexes() talked to it at import
+    try:
+        client.models.list()
+        logger.info("✅ OpenAI connection warmed up")
+    except Exception as e:
+        logger.warning("⚠️  Could not warm up OpenAI connection: %s", e)
+    
+    warm_wordpress_pool()
 
 # The "Agent Loop"
 logger.info("🚀 Agent Worker Starting - Watching for task changes...")
+warm_up_clients()
+threading.Thread(target=watch_stale_claims, name="stale-claims", daemon=True).start()
 logger.info("📋 Watching for: INSERT and UPDATE operations")
 
 retry_count = 0
 max_retries = 5
 
+RESUME_TOKEN_ID = "agent_worker_token"
+CHANGE_STREAM_HISTORY_LOST = 286
+
 while retry_count < max_retries:
     try:
         # Watch for both INSERT and UPDATE operations
@@ -217,7 +529,12 @@ while retry_count < max_retries:
             }
         ]
         
-        with db.tasks.watch(pipeline) as stream:
+        # Resume after the last handled event so a restart neither replays nor drops changes
+        checkpoint = db.meta.find_one({"_id": RESUME_TOKEN_ID})
+        resume_token = checkpoint.get("token") if checkpoint else None
+        
+        # updateLookup delivers the post-image with each event, so no extra find_one is needed
+        with db.tasks.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
             logger.info("✅ Change stream opened successfully")
             logger.info("⏳ Listening for changes... (Press Ctrl+C to stop)")
             retry_count = 0  # Reset retry count on successful connection
@@ -228,53 +545,74 @@ while retry_count < max_retries:
                     operation = change.get("operationType")
                     
                     if not task_id:
-                        logger.warning(f"⚠️  Change detected but no task_id found: {change.get('documentKey')}")
+                        logger.warning("⚠️  Change detected but no task_id found: %s", change.get('documentKey'))
                         continue
                     
-                    logger.info(f"\n📡 Change detected!")
-                    logger.info(f"   Operation Type: {operation}")
-                    logger.info(f"   Task ID: {task_id}")
+                    logger.info("\n📡 Change detected!")
+                    logger.info("   Operation Type: %s", operation)
+                    logger.info("   Task ID: %s", task_id)
                     
                     if operation == "insert":
-                        logger.info(f"   Type: New task inserted")
-                    elif operation == "update":
+                        logger.info("   Type: New task inserted")
+                    elif operation == "update" and logger.isEnabledFor(logging.INFO):
+                        # Only walk the update description when it will actually be logged
                         updated_fields = change.get("updateDescription", {}).get("updatedFields", {})
-                        logger.info(f"   Updated fields: {list(updated_fields.keys())}")
+                        logger.info("   Updated fields: %s", list(updated_fields))
                     
-                    # Fetch current task state
-                    task = db.tasks.find_one({"_id": task_id})
+                    # Current task state, as looked up by the change stream
+                    task = change.get("fullDocument")
                     
                     if task:
                         current_status = task.get("status", "UNKNOWN")
-                        logger.info(f"   Current task status: {current_status}")
+                        logger.info("   Current task status: %s", current_status)
                         
                         if current_status == "PHOTOS_UPLOADED":
-                            logger.info(f"🎯 ✨ Status is PHOTOS_UPLOADED - triggering Agent 2A!")
-                            color_correct_agent(task_id, task)
+                            claimed = claim_task(task_id, "PHOTOS_UPLOADED", "COLOR_CORRECTING")
+                            if claimed:
+                                logger.info("🎯 ✨ Status is PHOTOS_UPLOADED - triggering Agent 2A!")
+                                color_correct_agent(task_id, claimed)
+                            else:
+                                logger.info("   ℹ️  Skipping - task already claimed by another worker")
                         elif current_status == "COLOR_CORRECTED":
-                            logger.info(f"🎯 ✨ Status is COLOR_CORRECTED - triggering Agent 2B (WordPress)!")
-                            publish_to_wordpress(task_id, task)
+                            claimed = claim_task(task_id, "COLOR_CORRECTED", "PUBLISHING")
+                            if claimed:
+                                logger.info("🎯 ✨ Status is COLOR_CORRECTED - triggering Agent 2B (WordPress)!")
+                                publish_to_wordpress(task_id, claimed, WORKER_ID)
+                            else:
+                                logger.info("   ℹ️  Skipping - task already claimed by another worker")
                         else:
-                            logger.info(f"   ℹ️  Skipping - waiting for 'PHOTOS_UPLOADED' or 'COLOR_CORRECTED' status")
+                            logger.info("   ℹ️  Skipping - waiting for 'PHOTOS_UPLOADED' or 'COLOR_CORRECTED' status")
                     else:
-                        logger.warning(f"   ⚠️  Task not found in database (may have been deleted)")
+                        logger.warning("   ⚠️  Task not found in database (may have been deleted)")
                         
                 except Exception as e:
-                    logger.error(f"❌ Error processing change: {e}", exc_info=True)
+                    logger.error("❌ Error processing change: %s", e, exc_info=True)
+                finally:
+                    db.meta.update_one(
+                        {"_id": RESUME_TOKEN_ID},
+                        {"$set": {"token": change["_id"]}},
+                        upsert=True
+                    )
                     
     except KeyboardInterrupt:
         logger.info("\n🛑 Agent Worker stopping (Ctrl+C pressed)...")
         break
     except Exception as e:
+        if isinstance(e, OperationFailure) and e.code == CHANGE_STREAM_HISTORY_LOST:
+            # The saved token has aged out of the oplog - start from the current position
+            logger.warning("⚠️  Resume token expired, restarting change stream from now: %s", e)
+            db.meta.delete_one({"_id": RESUME_TOKEN_ID})
+            continue
+        
         retry_count += 1
-        logger.error(f"❌ Change stream error (attempt {retry_count}/{max_retries}): {e}", exc_info=True)
+        logger.error("❌ Change stream error (attempt %s/%s): %s", retry_count, max_retries, e, exc_info=True)
         
         if retry_count < max_retries:
             wait_time = 2 ** retry_count  # Exponential backoff
-            logger.info(f"🔄 Reconnecting in {wait_time} seconds...")
+            logger.info("🔄 Reconnecting in %s seconds...", wait_time)
             time.sleep(wait_time)
         else:
-            logger.error(f"❌ Failed to connect after {max_retries} attempts. Exiting.")
+            logger.error("❌ Failed to connect after %s attempts. Exiting.", max_retries)
             break
 
 logger.info("👋 Agent Worker shut down")
\ No newline at end of file
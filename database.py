@@ -1,10 +1,75 @@
 import os
+import functools
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
+try:
+    import zstandard
+except ImportError:
+    # zstandard isn't installed - talk to MongoDB uncompressed
+    zstandard = None
+
 load_dotenv()
 
+INDEX_NOT_FOUND = 27
+INDEX_OPTIONS_CONFLICT = 85
+# Failed agent runs (abandoned claims included) before a task is parked as failed
+MAX_TASK_ATTEMPTS = 5
+
+@functools.lru_cache(maxsize=1)
 def get_db():
-    # Uses the connection string from your Atlas 'Connect' button
-    client = MongoClient(os.getenv("MONGODB_URI"))
-    return client.photo_workflow  # This must match your DB name in Compass
\ No newline at end of file
+    # Uses the connection string from your Atlas 'Connect' button. Cached so every
+    # module shares one client and its connection pool instead of re-running discovery + TLS
+    options = {"compressors": "zstd"} if zstandard is not None else {}
+    client = MongoClient(
+        os.getenv("MONGODB_URI"),
+        maxPoolSize=50,
+        minPoolSize=5,
+        **options
+    )
+    return client.photo_workflow  # This must match your DB name in Compass
+
+def ensure_indexes(db):
+    """Create the indexes the agents query on (no-op when they already exist)"""
+    # Any sku_code index serves upload_photo's upsert lookup; the unique one
+    # comes from migrate_unique_sku_index(), so don't fight it with a plain one
+    if "sku_code_1" not in db.tasks.index_information():
+        db.tasks.create_index([("sku_code", 1)])
+    db.tasks.create_index([("status", 1)])
+
+def migrate_unique_sku_index(db):
+    """
+    One-off migration: make tasks.sku_code unique, so upload_photo's upsert can
+    never create two tasks for one SKU. Refuses to run while duplicates exist.
+    """
+    duplicates = list(db.tasks.aggregate([
+        {"$match": {"sku_code": {"$exists": True}}},
+        {"$group": {"_id": "$sku_code", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": 10}
+    ]))
+    if duplicates:
+        listed = ", ".join(f"{d['_id']} ({d['count']} tasks)" for d in duplicates)
+        raise RuntimeError(
+            f"Cannot make sku_code unique, these SKUs have several tasks: {listed}. "
+            "Merge or delete the extra tasks, then run the migration again."
+        )
+    
+    # Sparse so documents without a SKU (e.g. debug inserts) don't collide
+    try:
+        db.tasks.create_index([("sku_code", 1)], unique=True, sparse=True)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        # Replace the plain sku_code index; another run may have dropped it already
+        try:
+            db.tasks.drop_index([("sku_code", 1)])
+        except OperationFailure as e:
+            if e.code != INDEX_NOT_FOUND:
+                raise
+        db.tasks.create_index([("sku_code", 1)], unique=True, sparse=True)
+
+if __name__ == "__main__":
+    migrate_unique_sku_index(get_db())
+    print("✅ tasks.sku_code is now unique")
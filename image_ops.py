@@ -0,0 +1,129 @@
+"""
+Image operations for Agent 2A
+Pixel passes that reproduce PIL's ImageEnhance chain (Brightness -> Contrast
+-> Color -> Sharpness) on RGB uint8 arrays, with optional Numba kernels
+"""
+
+import threading
+import numpy as np
+from PIL import Image, ImageEnhance
+
+try:
+    from numba import njit, prange, types
+except ImportError:
+    # Numba isn't installed - tone and sharpen with Pillow's ImageEnhance
+    njit = None
+
+# PIL's ImageFilter.SMOOTH kernel (scale 13), the degenerate image for sharpness
+SMOOTH_KERNEL = (1, 1, 1, 1, 5, 1, 1, 1, 1)
+
+if njit is not None:
+    # Kernels are compiled eagerly at import (explicit signatures) and cached on
+    # disk, so no JIT stall hits the agent loop, even on a cold start. src is
+    # typed read-only so buffers Pillow hands back can be passed without a copy.
+    # Like PIL's ImagingBlend, each blend is computed in float32 and truncated
+    @njit(
+        types.void(
+            types.Array(types.uint8, 3, "C", readonly=True), types.uint8[:, :, ::1],
+            types.uint8[::1], types.float32
+        ),
+        parallel=True, cache=True
+    )
+    def blend_tones_kernel(src, dst, lut, saturation):
+        """Brightness/contrast table then saturation, one image row per thread, no float buffer"""
+        height, width, channels = src.shape
+        for y in prange(height):
+            for x in range(width):
+                red = np.int32(lut[src[y, x, 0]])
+                green = np.int32(lut[src[y, x, 1]])
+                blue = np.int32(lut[src[y, x, 2]])
+                # PIL's fixed-point "L" conversion, rounded
+                gray = np.float32((red * 19595 + green * 38470 + blue * 7471 + 0x8000) >> 16)
+                for c in range(channels):
+                    value = gray + saturation * (np.float32(lut[src[y, x, c]]) - gray)
+                    dst[y, x, c] = min(max(value, np.float32(0.0)), np.float32(255.0))
+    
+    @njit(
+        types.void(types.Array(types.uint8, 3, "C", readonly=True), types.uint8[:, :, ::1], types.float32),
+        parallel=True, cache=True
+    )
+    def sharpen_kernel(src, dst, factor):
+        """Blend with PIL's SMOOTH blur, one image row per thread"""
+        height, width, channels = src.shape
+        for y in prange(1, height - 1):
+            for x in range(1, width - 1):
+                for c in range(channels):
+                    center = np.int32(src[y, x, c])
+                    total = (
+                        np.int32(src[y - 1, x - 1, c]) + np.int32(src[y - 1, x, c]) + np.int32(src[y - 1, x + 1, c])
+                        + np.int32(src[y, x - 1, c]) + 5 * center + np.int32(src[y, x + 1, c])
+                        + np.int32(src[y + 1, x - 1, c]) + np.int32(src[y + 1, x, c]) + np.int32(src[y + 1, x + 1, c])
+                    )
+                    smooth = np.float32((2 * total + 13) // 26)  # total / 13, rounded like PIL's filter
+                    value = smooth + factor * (np.float32(center) - smooth)
+                    dst[y, x, c] = min(max(value, np.float32(0.0)), np.float32(255.0))
+else:
+    blend_tones_kernel = None
+    sharpen_kernel = None
+
+# The kernels already use every core, and Numba's default threading layer
+# can't run two parallel kernels at once, so photo threads take turns
+kernel_lock = threading.Lock()
+
+def brightness_levels(brightness):
+    """ImageEnhance.Brightness as a 256-level table (PIL blends in float32 and truncates)"""
+    levels = np.float32(brightness) * np.arange(256, dtype=np.float32)
+    return np.clip(levels, 0, 255).astype(np.uint8)
+
+def histogram_pivot(luma_histogram):
+    """
+    The gray level ImageEnhance.Contrast pivots on: the mean of the image's
+    "L" conversion, rounded to an integer. luma_histogram holds the 256 level
+    counts of that "L" image (for the brightened photo when Brightness comes first)
+    """
+    luma_histogram = np.asarray(luma_histogram, dtype=np.int64)
+    # Integer sum, one float division, like ImageStat
+    return int(np.arange(256) @ luma_histogram / luma_histogram.sum() + 0.5)
+
+def contrast_pivot(pixels, brightness):
+    """histogram_pivot for an RGB uint8 array brightened by brightness"""
+    img = Image.fromarray(pixels, "RGB")
+    if brightness != 1.0:
+        # Per-pixel luma rounds after the channels are mixed, so a per-channel
+        # histogram can't give it; brighten a copy and convert, as PIL does
+        img = img.point(brightness_levels(brightness).tolist() * 3)
+    return histogram_pivot(img.convert("L").histogram())
+
+def tone_lut(brightness, contrast, pivot):
+    """Build the uint8 lookup table for ImageEnhance.Brightness followed by Contrast"""
+    levels = brightness_levels(brightness).astype(np.float32)
+    # Contrast blends the brightened levels with a flat image at the pivot, truncating like PIL
+    levels = pivot + np.float32(contrast) * (levels - pivot)
+    return np.clip(levels, 0, 255).astype(np.uint8)
+
+def blend_tones(pixels, brightness, contrast, saturation):
+    """Apply brightness, contrast and then saturation to an RGB uint8 array"""
+    # Brightness and contrast act on each level independently, so they stay one
+    # table; saturation mixes channels and must see the clipped, toned levels
+    lut = tone_lut(brightness, contrast, contrast_pivot(pixels, brightness))
+    
+    if blend_tones_kernel is not None:
+        src = np.ascontiguousarray(pixels)
+        dst = np.empty_like(src)
+        with kernel_lock:
+            blend_tones_kernel(src, dst, lut, np.float32(saturation))
+        return dst
+    
+    toned = Image.fromarray(lut[pixels], "RGB")
+    return np.asarray(ImageEnhance.Color(toned).enhance(saturation))
+
+def sharpen(pixels, factor):
+    """Blend an RGB uint8 array with its smoothed copy, like ImageEnhance.Sharpness"""
+    if sharpen_kernel is not None:
+        src = np.ascontiguousarray(pixels)
+        dst = src.copy()  # border pixels are left untouched, as in PIL
+        with kernel_lock:
+            sharpen_kernel(src, dst, np.float32(factor))
+        return dst
+    
+    return np.asarray(ImageEnhance.Sharpness(Image.fromarray(pixels, "RGB")).enhance(factor))
@@ -63,7 +63,8 @@ def test_agentic_flow():
         }
     }
     
-    # Insert the task
+    # Insert the task (sku_code is unique, so clear any task left by a previous run)
+    db.tasks.delete_many({"sku_code": test_task["sku_code"]})
     db.tasks.insert_one(test_task)
     logger.info(f"✓ Created test task: {task_id}")
     logger.info(f"  Status: INITIATED")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Parity check for Agent 2A's color corrections.
+The pixel passes in image_ops must reproduce PIL's ImageEnhance chain
+(Brightness -> Contrast -> Color -> Sharpness) on the sample product photo.
+"""
+
+import os
+import logging
+import numpy as np
+from PIL import Image, ImageEnhance
+from image_ops import contrast_pivot, tone_lut, blend_tones, sharpen
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("test_color_parity")
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_product.jpg")
+# (brightness, contrast, saturation, sharpness); the first row is the agent's own setting
+ADJUSTMENTS = [
+    (1.05, 1.1, 1.15, 1.2),
+    (1.4, 0.7, 0.8, 0.5),
+    (0.8, 1.3, 1.5, 2.0),
+]
+
+def load_sample():
+    with Image.open(SAMPLE_PATH) as img:
+        return np.asarray(img.convert("RGB"))
+
+def rounded_luma_image():
+    """
+    52% (0, 0, 4) and 48% (1, 1, 1): every pixel's "L" rounds to 0 or 1, so the
+    mean luma is 0.48, while the luma of the channel means is about 0.73
+    """
+    pixels = np.empty((10, 10, 3), dtype=np.uint8)
+    pixels.reshape(-1, 3)[:52] = (0, 0, 4)
+    pixels.reshape(-1, 3)[52:] = (1, 1, 1)
+    return pixels
+
+def assert_identical(name, actual, expected):
+    diff = np.abs(actual.astype(np.int16) - expected.astype(np.int16))
+    logger.info("   %s: max diff %s, %s values differ", name, diff.max(), np.count_nonzero(diff))
+    assert not diff.any(), f"{name}: up to {diff.max()} levels off PIL"
+
+def test_tone_lut():
+    """Brightness + Contrast as one lookup table"""
+    pixels = load_sample()
+    for brightness, contrast, _, _ in ADJUSTMENTS:
+        img = ImageEnhance.Brightness(Image.fromarray(pixels)).enhance(brightness)
+        expected = np.asarray(ImageEnhance.Contrast(img).enhance(contrast))
+        actual = tone_lut(brightness, contrast, contrast_pivot(pixels, brightness))[pixels]
+        assert_identical(f"tone_lut{(brightness, contrast)}", actual, expected)
+
+def test_rounded_luma_pivot():
+    """The contrast pivot averages per-pixel rounded luma, like PIL"""
+    pixels = rounded_luma_image()
+    expected = np.asarray(ImageEnhance.Contrast(Image.fromarray(pixels)).enhance(2.0))
+    actual = tone_lut(1.0, 2.0, contrast_pivot(pixels, 1.0))[pixels]
+    assert_identical("tone_lut(rounded luma)", actual, expected)
+
+def test_blend_tones():
+    """Brightness + Contrast + Color"""
+    pixels = load_sample()
+    for brightness, contrast, saturation, _ in ADJUSTMENTS:
+        img = ImageEnhance.Brightness(Image.fromarray(pixels)).enhance(brightness)
+        img = ImageEnhance.Contrast(img).enhance(contrast)
+        expected = np.asarray(ImageEnhance.Color(img).enhance(saturation))
+        actual = blend_tones(pixels, brightness, contrast, saturation)
+        assert_identical(f"blend_tones{(brightness, contrast, saturation)}", actual, expected)
+
+def test_sharpen():
+    """Sharpness"""
+    pixels = load_sample()
+    for _, _, _, sharpness in ADJUSTMENTS:
+        expected = np.asarray(ImageEnhance.Sharpness(Image.fromarray(pixels)).enhance(sharpness))
+        assert_identical(f"sharpen({sharpness})", sharpen(pixels, sharpness), expected)
+
+if __name__ == "__main__":
+    logger.info("🧪 Checking color corrections against PIL's ImageEnhance...")
+    test_tone_lut()
+    test_rounded_luma_pivot()
+    test_blend_tones()
+    test_sharpen()
+    logger.info("✅ All color corrections match PIL")
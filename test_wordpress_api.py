@@ -26,10 +26,13 @@ if not WORDPRESS_URL or not WORDPRESS_USER or not WORDPRESS_PASSWORD:
     print("   WORDPRESS_PASSWORD=application_password")
     exit(1)
 
+# Both checks hit the same host, so share one keep-alive connection
+session = requests.Session()
+
 # Test basic API access
 try:
     print("\n1️⃣  Testing basic API access...")
-    response = requests.get(f"{WORDPRESS_URL}/wp-json/", timeout=10)
+    response = session.get(f"{WORDPRESS_URL}/wp-json/", timeout=10)
     print(f"   Status: {response.status_code}")
     if response.status_code == 200:
         print("   ✅ API is accessible")
@@ -47,7 +50,7 @@ try:
         'User-Agent': 'CatalogiQ/1.0'
     }
     
-    response = requests.get(
+    response = session.get(
         f"{WORDPRESS_URL}/wp-json/wp/v2/users/me",
         headers=headers,
         timeout=10
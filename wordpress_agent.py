@@ -4,12 +4,24 @@ Publishes color-corrected images to WordPress
 """
 
 import os
+import ssl
+import mmap
 import logging
 import requests
 import base64
+import certifi
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from pathlib import Path
-from database import get_db
+from pymongo import UpdateOne
+from database import get_db, MAX_TASK_ATTEMPTS
+
+try:
+    import orjson
+except ImportError:
+    # orjson isn't installed - parse responses with the stdlib json module
+    orjson = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -24,47 +36,91 @@ WORDPRESS_URL = os.getenv("WORDPRESS_URL", "").rstrip("/")
 WORDPRESS_USER = os.getenv("WORDPRESS_USER", "")
 WORDPRESS_PASSWORD = os.getenv("WORDPRESS_PASSWORD", "")
 WORDPRESS_REST_ENDPOINT = f"{WORDPRESS_URL}/wp-json/wp/v2"
+# Photos of one task uploaded concurrently (within the session's connection pool)
+MAX_UPLOAD_WORKERS = 8
+
+# Headers that bypass Mod_Security better - identical for every upload, so built once
+_STATIC_HEADERS = {
+    'Content-Type': 'image/jpeg',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',  # Browser user agent
+    'Accept': 'application/json',
+    'Cache-Control': 'no-cache',
+    'Pragma': 'no-cache',
+    'X-Requested-With': 'XMLHttpRequest',
+    # Keep pooled sockets open between uploads. No Expect header is needed:
+    # urllib3 never sends "Expect: 100-continue", so bodies go out without waiting
+    'Connection': 'keep-alive'
+}
+# Basic auth, encoded once (publishing is skipped when credentials are missing)
+_AUTH_HEADER = None
+if WORDPRESS_USER and WORDPRESS_PASSWORD:
+    _AUTH_HEADER = 'Basic ' + base64.b64encode(f"{WORDPRESS_USER}:{WORDPRESS_PASSWORD}".encode()).decode()
+    _STATIC_HEADERS['Authorization'] = _AUTH_HEADER
+
+# Verify the WordPress certificate against certifi's CA bundle, parsed once at import
+_SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+class _SSLContextAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools all share _SSL_CONTEXT"""
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = _SSL_CONTEXT
+        return super().init_poolmanager(*args, **kwargs)
+    
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if verify is True:
+            # _SSL_CONTEXT already trusts certifi's bundle; with ca_certs set,
+            # urllib3 would load a CA file into it on every new connection
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+
+# One pooled session for every upload, so each photo reuses an open
+# keep-alive connection instead of paying a fresh TCP + TLS handshake.
+# Everything goes to the one WordPress host: a single pool sized to the
+# upload workers, blocking rather than opening throwaway overflow sockets
+_ADAPTER = _SSLContextAdapter(
+    pool_connections=1,
+    pool_maxsize=MAX_UPLOAD_WORKERS,
+    pool_block=True,
+    # Transient failures are retried with exponential backoff, honouring
+    # Retry-After; uploads (POST) and the warm-up HEADs are both retryable
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"HEAD", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False  # hand back the last response once retries run out
+    )
+)
+_SESSION = requests.Session()
+_SESSION.headers.update(_STATIC_HEADERS)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
 
 def upload_to_wordpress(file_path, filename):
     """Upload a single file to WordPress media library"""
     try:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}")
-        
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
+        # No exists() check: callers check first, and open() below raises
+        # FileNotFoundError into the handler if the file has since vanished
+        logger.info("      🔄 Uploading %s to WordPress...", filename)
+        logger.info("      📍 Endpoint: %s/media", WORDPRESS_REST_ENDPOINT)
         
-        # Create proper authentication header
-        auth_string = base64.b64encode(f"{WORDPRESS_USER}:{WORDPRESS_PASSWORD}".encode()).decode()
-        
-        # Headers that bypass Mod_Security better
-        headers = {
-            'Authorization': f'Basic {auth_string}',
-            'Content-Disposition': f'attachment; filename="{filename}"',
-            'Content-Type': 'image/jpeg',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',  # Browser user agent
-            'Accept': 'application/json',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache',
-            'X-Requested-With': 'XMLHttpRequest'
-        }
-        
-        logger.info(f"      🔄 Uploading {filename} to WordPress...")
-        logger.info(f"      📍 Endpoint: {WORDPRESS_REST_ENDPOINT}/media")
-        
-        # Try with direct upload first
-        response = requests.post(
-            f"{WORDPRESS_REST_ENDPOINT}/media",
-            data=file_data,
-            headers=headers,
-            timeout=30,
-            verify=False  # Ignore SSL warnings for now
-        )
+        # Try with direct upload first - send the file as a read-only mapping instead
+        # of reading it into memory; a retried send rewinds and reuses the same
+        # page-cached buffer (requests sets Content-Length from its size)
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as body:
+            response = _SESSION.post(
+                f"{WORDPRESS_REST_ENDPOINT}/media",
+                data=body,
+                headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+                timeout=(5, 30)
+            )
         
-        logger.info(f"      Status: {response.status_code}")
+        logger.info("      Status: %s", response.status_code)
         
         if response.status_code in [200, 201]:
-            media_data = response.json()
+            media_data = orjson.loads(response.content) if orjson else response.json()
             return {
                 "success": True,
                 "media_id": media_data.get('id'),
@@ -72,17 +128,9 @@ def upload_to_wordpress(file_path, filename):
                 "status_code": response.status_code
             }
         else:
-            logger.error(f"      Status: {response.status_code}")
+            logger.error("      Status: %s", response.status_code)
             if response.text:
-                logger.error(f"      Response: {response.text[:200]}")
-            
-            # If Mod_Security blocks, suggest solutions
-            if response.status_code == 406:
-                logger.warning(f"\n      💡 Got 406 (Mod_Security blocking)")
-                logger.warning(f"      Solutions:")
-                logger.warning(f"      1. Contact your host to whitelist /wp-json/wp/v2/media")
-                logger.warning(f"      2. Add .htaccess exception (see instructions)")
-                logger.warning(f"      3. Try uploading via FTP instead")
+                logger.error("      Response: %.200s", response.text)
             
             return {
                 "success": False,
@@ -91,122 +139,207 @@ def upload_to_wordpress(file_path, filename):
             }
             
     except Exception as e:
-        logger.error(f"      Exception: {str(e)}")
+        logger.error("      Exception: %s", e)
         return {
             "success": False,
             "error": str(e)
         }
 
-def publish_to_wordpress(task_id, task_data):
+def warm_wordpress_pool():
     """
-    Agent 2B: Publish color-corrected images to WordPress
+    Fill the upload connection pool before the first task, so no photo's
+    upload waits on a TCP + TLS handshake
     """
+    if not WORDPRESS_URL:
+        return
+    
+    def head(_):
+        return _SESSION.head(f"{WORDPRESS_URL}/wp-json/", timeout=5)
+    
+    # Concurrent requests each check out their own connection, opening every slot
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as executor:
+            list(executor.map(head, range(MAX_UPLOAD_WORKERS)))
+        logger.info("✅ WordPress connection pool warmed up (%s connections)", MAX_UPLOAD_WORKERS)
+    except Exception as e:
+        logger.warning("⚠️  Could not warm up WordPress connections: %s", e)
+
+def publish_photo(idx, analysis, total):
+    """Upload a single color-corrected photo, returning its publish result"""
     try:
-        logger.info(f"📱 Agent 2B: Starting WordPress publish for task {task_id}...")
+        logger.info("   📸 Publishing photo %s/%s...", idx + 1, total)
         
-        color_analysis = task_data.get("color_analysis", [])
-        sku_code = task_data.get("sku_code", "UNKNOWN")
-        product_name = task_data.get("metadata", {}).get("product_name", "UNKNOWN")
+        # Runs on an upload worker, so stats on a slow (network) filesystem
+        # overlap with each other and with other photos' uploads
+        corrected_path = analysis.get("corrected_path")
+        if not corrected_path or not os.path.exists(corrected_path):
+            logger.warning("      ⚠️  Corrected image not found: %s", corrected_path)
+            return {
+                "photo_index": idx + 1,
+                "status": "failed",
+                "reason": "Corrected image not found"
+            }
         
-        logger.info(f"   SKU: {sku_code}")
-        logger.info(f"   Product: {product_name}")
-        logger.info(f"   Photos to publish: {len(color_analysis)}")
+        filename = os.path.basename(corrected_path)
+        result = upload_to_wordpress(corrected_path, filename)
         
-        # Check if WordPress is configured
-        if not WORDPRESS_URL or not WORDPRESS_USER or not WORDPRESS_PASSWORD:
-            logger.warning(f"   ⚠️  WordPress credentials not configured in .env")
-            logger.info(f"   Required: WORDPRESS_URL, WORDPRESS_USER, WORDPRESS_PASSWORD")
-            logger.info(f"   Current: URL={WORDPRESS_URL}, USER={WORDPRESS_USER}")
+        if result.get("success"):
+            logger.info("      ✅ Published! Media ID: %s", result['media_id'])
+            logger.info("      🔗 URL: %s", result['media_url'])
             
-            publish_results = [{
+            return {
                 "photo_index": idx + 1,
-                "status": "skipped",
-                "reason": "WordPress credentials not fully configured"
-            } for idx in range(len(color_analysis))]
-        else:
-            publish_results = []
-            
-            for idx, analysis in enumerate(color_analysis):
-                try:
-                    logger.info(f"   📸 Publishing photo {idx + 1}/{len(color_analysis)}...")
-                    
-                    corrected_path = analysis.get("corrected_path")
-                    if not corrected_path or not os.path.exists(corrected_path):
-                        logger.warning(f"      ⚠️  Corrected image not found: {corrected_path}")
-                        publish_results.append({
-                            "photo_index": idx + 1,
-                            "status": "failed",
-                            "reason": "Corrected image not found"
-                        })
-                        continue
-                    
-                    filename = Path(corrected_path).name
-                    result = upload_to_wordpress(corrected_path, filename)
-                    
-                    if result.get("success"):
-                        logger.info(f"      ✅ Published! Media ID: {result['media_id']}")
-                        logger.info(f"      🔗 URL: {result['media_url']}")
-                        
-                        publish_results.append({
-                            "photo_index": idx + 1,
-                            "status": "published",
-                            "media_id": result["media_id"],
-                            "media_url": result["media_url"],
-                            "file_path": corrected_path
-                        })
-                    else:
-                        logger.error(f"      ❌ Upload failed: {result.get('error')}")
-                        publish_results.append({
-                            "photo_index": idx + 1,
-                            "status": "failed",
-                            "error": result.get("error"),
-                            "status_code": result.get("status_code")
-                        })
-                        
-                except Exception as e:
-                    logger.error(f"      ❌ Error publishing photo {idx + 1}: {e}")
-                    publish_results.append({
-                        "photo_index": idx + 1,
-                        "status": "failed",
-                        "error": str(e)
-                    })
+                "status": "published",
+                "media_id": result["media_id"],
+                "media_url": result["media_url"],
+                "file_path": corrected_path
+            }
         
-        # Log agent action
-        agent_log_entry = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "agent": "wordpress_publish_agent_2b",
-            "action": "wordpress_publish_completed",
-            "thought": f"Published {len([r for r in publish_results if r.get('status') == 'published'])} photos to WordPress"
+        logger.error("      ❌ Upload failed: %s", result.get('error'))
+        return {
+            "photo_index": idx + 1,
+            "status": "failed",
+            "error": result.get("error"),
+            "status_code": result.get("status_code")
         }
         
-        # Update task with publish results
-        next_status = "WORDPRESS_PUBLISHED" if any(r.get('status') == 'published' for r in publish_results) else "PUBLISH_FAILED"
+    except Exception as e:
+        logger.error("      ❌ Error publishing photo %s: %s", idx + 1, e)
+        return {
+            "photo_index": idx + 1,
+            "status": "failed",
+            "error": str(e)
+        }
+
+def publish_task(task_id, task_data):
+    """
+    Upload one task's color-corrected photos to WordPress and return the
+    MongoDB update that records the outcome (the caller performs the write)
+    """
+    logger.info("📱 Agent 2B: Starting WordPress publish for task %s...", task_id)
+    
+    color_analysis = task_data.get("color_analysis", [])
+    
+    # Nothing to upload - mark the task failed without the agent log or the upload pool
+    if not color_analysis:
+        logger.warning("   ⚠️  No color-corrected photos to publish")
+        return {
+            "$set": {"status": "PUBLISH_FAILED", "workflow_step": 3, "wordpress_publish_results": []},
+            "$unset": {"worker_id": "", "claimed_at": ""}
+        }
+    
+    sku_code = task_data.get("sku_code", "UNKNOWN")
+    product_name = task_data.get("metadata", {}).get("product_name", "UNKNOWN")
+    
+    logger.info("   SKU: %s", sku_code)
+    logger.info("   Product: %s", product_name)
+    logger.info("   Photos to publish: %s", len(color_analysis))
+    
+    # Check if WordPress is configured
+    if not WORDPRESS_URL or not WORDPRESS_USER or not WORDPRESS_PASSWORD:
+        logger.warning("   ⚠️  WordPress credentials not configured in .env")
+        logger.info("   Required: WORDPRESS_URL, WORDPRESS_USER, WORDPRESS_PASSWORD")
+        logger.info("   Current: URL=%s, USER=%s", WORDPRESS_URL, WORDPRESS_USER)
         
-        db.tasks.update_one(
-            {"_id": task_id},
-            {
-                "$set": {
-                    "status": next_status,
-                    "workflow_step": 3,
-                    "wordpress_publish_results": publish_results
-                },
-                "$push": {"agent_log": agent_log_entry}
-            }
-        )
+        publish_results = [{
+            "photo_index": idx + 1,
+            "status": "skipped",
+            "reason": "WordPress credentials not fully configured"
+        } for idx in range(len(color_analysis))]
+    else:
+        # Uploads are network-bound, so send a task's photos concurrently
+        total = len(color_analysis)
+        with ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as executor:
+            publish_results = list(executor.map(lambda item: publish_photo(*item, total), enumerate(color_analysis)))
+    
+    published_count = sum(1 for r in publish_results if r.get('status') == 'published')
+    
+    # Log agent action
+    agent_log_entry = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "agent": "wordpress_publish_agent_2b",
+        "action": "wordpress_publish_completed",
+        "thought": f"Published {published_count} photos to WordPress"
+    }
+    
+    # Update task with publish results
+    next_status = "WORDPRESS_PUBLISHED" if published_count else "PUBLISH_FAILED"
+    
+    return {
+        "$set": {
+            "status": next_status,
+            "workflow_step": 3,
+            "wordpress_publish_results": publish_results
+        },
+        "$push": {"agent_log": agent_log_entry},
+        "$unset": {"worker_id": "", "claimed_at": ""}
+    }
+
+def claim_filter(task_id, worker_id):
+    """Matches the task only while worker_id's PUBLISHING claim on it still holds"""
+    return {"_id": task_id, "status": "PUBLISHING", "worker_id": worker_id}
+
+def error_update(task_id, task_data, error):
+    """
+    MongoDB update that records a failed publish attempt in retry_metadata and
+    hands the task back to COLOR_CORRECTED, so the publish is retried - or,
+    once it has failed MAX_TASK_ATTEMPTS times, marks it PUBLISH_FAILED
+    """
+    attempts = (task_data.get("retry_metadata") or {}).get("count", 0) + 1
+    next_status = "COLOR_CORRECTED" if attempts < MAX_TASK_ATTEMPTS else "PUBLISH_FAILED"
+    if next_status == "PUBLISH_FAILED":
+        logger.error("❌ Agent 2B: Task %s failed %s times, giving up", task_id, attempts)
+    
+    return {
+        "$set": {"status": next_status, "retry_metadata.last_error": str(error)},
+        "$inc": {"retry_metadata.count": 1},
+        "$unset": {"worker_id": "", "claimed_at": ""}
+    }
+
+def publish_to_wordpress(task_id, task_data, worker_id):
+    """
+    Agent 2B: Publish color-corrected images to WordPress
+    task_data is the task as claimed (status PUBLISHING) by worker_id
+    """
+    try:
+        update = publish_task(task_id, task_data)
+        # Only while our claim still holds: once the lease has expired another
+        # worker owns the task, and its outcome must not be overwritten
+        result = db.tasks.update_one(claim_filter(task_id, worker_id), update)
+        if result.modified_count == 0:
+            logger.warning("⚠️  Agent 2B: Task %s is no longer claimed by this worker, skipping write", task_id)
+            return
         
-        logger.info(f"✅ Agent 2B: Completed - task {task_id} status set to {next_status}")
-        logger.info(f"   📊 Published {len(publish_results)} media files")
+        logger.info("✅ Agent 2B: Completed - task %s status set to %s", task_id, update['$set']['status'])
+        logger.info("   📊 Published %s media files", len(update['$set']['wordpress_publish_results']))
         
     except Exception as e:
-        logger.error(f"❌ Agent 2B Error publishing task {task_id}: {e}", exc_info=True)
+        logger.error("❌ Agent 2B Error publishing task %s: %s", task_id, e, exc_info=True)
         
         try:
-            db.tasks.update_one(
-                {"_id": task_id},
-                {
-                    "$set": {"retry_metadata.last_error": str(e)},
-                    "$inc": {"retry_metadata.count": 1}
-                }
-            )
+            db.tasks.update_one(claim_filter(task_id, worker_id), error_update(task_id, task_data, e))
         except Exception as e2:
-            logger.error(f"❌ Failed to log error: {e2}")
+            logger.error("❌ Failed to log error: %s", e2)
+
+def publish_to_wordpress_many(tasks, worker_id):
+    """
+    Agent 2B for a batch: publish each (task_id, task_data) pair claimed by
+    worker_id, then record every outcome in one unordered bulk write instead
+    of a round-trip per task (tasks whose claim has lapsed are left alone)
+    """
+    operations = []
+    for task_id, task_data in tasks:
+        try:
+            operations.append(UpdateOne(claim_filter(task_id, worker_id), publish_task(task_id, task_data)))
+        except Exception as e:
+            logger.error("❌ Agent 2B Error publishing task %s: %s", task_id, e, exc_info=True)
+            operations.append(UpdateOne(claim_filter(task_id, worker_id), error_update(task_id, task_data, e)))
+    
+    if not operations:
+        return
+    
+    try:
+        result = db.tasks.bulk_write(operations, ordered=False)
+        logger.info("✅ Agent 2B: Completed batch - %s/%s tasks updated", result.modified_count, len(operations))
+    except Exception as e:
+        logger.error("❌ Failed to record batch publish results: %s", e)